@@ -1,5 +1,4 @@
-import pickle
-
+import msgpack
 import zmq
 
 from app.control import listener
@@ -22,9 +21,9 @@ class Client:
             self.socket.setsockopt(zmq.AFFINITY, 1)
             self.socket.setsockopt(zmq.RCVTIMEO, 2000)
             self.socket.connect('tcp://127.0.0.1:%d' % self.port)
-        self.socket.send(pickle.dumps((command, data)))
+        self.socket.send(msgpack.packb((command, data)), copy=False)
         try:
-            err = pickle.loads(self.socket.recv())
+            err = msgpack.unpackb(self.socket.recv(), raw=False)
         except zmq.error.Again:
             err = ValueError("no response, is server available?")
             utils.print_fun(err)
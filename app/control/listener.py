@@ -1,6 +1,6 @@
-import pickle
 from app.tools import utils
 
+import msgpack
 import zmq
 
 DEFAULT_LISTENER_PORT = 43210
@@ -15,7 +15,10 @@ class Listener:
     def listen(self):
         while True:
             try:
-                command, data = pickle.loads(self.socket.recv())
+                # copy=False hands us the zmq frame buffer directly,
+                # msgpack decodes it without the pickle interpreter loop
+                msg = self.socket.recv(copy=False)
+                command, data = msgpack.unpackb(msg.buffer, raw=False)
                 # test, remove
                 if command == "error":
                     raise ValueError("test error")
@@ -25,4 +28,6 @@ class Listener:
                 self.result(e)
 
     def result(self, err=None):
-        self.socket.send(pickle.dumps(err))
+        # Errors cross the wire as strings: msgpack cannot encode
+        # exception objects and the client only reports them
+        self.socket.send(msgpack.packb(str(err) if err is not None else None), copy=False)
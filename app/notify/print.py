@@ -23,7 +23,6 @@ class NotifyPrint:
             msg_strings.extend([' - ' + o for o in kwargs['action_options']])
         if 'system' in kwargs:
             msg_strings.append('System: %s' % kwargs['system'])
-        sl = max([len(s) for s in msg_strings])
-        utils.print_fun('=' * sl)
-        utils.print_fun('\r\n'.join(msg_strings))
-        utils.print_fun('=' * sl)
+        sl = max(len(s) for s in msg_strings)
+        bar = '=' * sl
+        utils.print_fun('\n'.join((bar, '\r\n'.join(msg_strings), bar)))
@@ -6,6 +6,7 @@ import pickle
 import shutil
 import time
 
+import joblib
 import numpy as np
 from ml_serving.drivers import driver
 from sklearn import svm, neighbors
@@ -323,10 +324,14 @@ class Classifiers:
                 raise RuntimeError("Empty fit data")
             clf.fit(emb_array, fit_labels)
 
-            # Saving classifier model
+            # Saving classifier model.
+            # joblib stores the internal numpy arrays as raw blocks so the
+            # detector can load them back with mmap_mode (zero-copy).
             clf_fn = classifier_filename(classifiers_dir, algorithm)
-            with open(clf_fn, 'wb') as outfile:
-                pickle.dump((clf, class_names, class_stats), outfile, protocol=2)
+            joblib.dump(
+                (clf, class_names, class_stats), clf_fn,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
             print_fun('Saved classifier model to file "%s"' % clf_fn)
 
             # update_data({'average_time_%s': '%.3fms' % average_time}, use_mlboard, mlboard)
@@ -1,9 +1,13 @@
+import collections
+import functools
 import glob
+import hashlib
 import json
 import os
 import pickle
 
 import cv2
+import joblib
 from ml_serving.drivers import driver
 import numpy as np
 import six
@@ -13,11 +17,26 @@ from sklearn import svm, neighbors
 from app.recognize import classifiers, defaults
 from app.tools import images, utils
 import math
+import time
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 DETECTED = 1
 NOT_DETECTED = 2
 WRONG_FACE_POS = 3
 
+EMB_CACHE_SIZE = 256
+GLYPH_CACHE_SIZE = 512
+
+# Temporal gating: a bbox overlapping a recent confidently recognized track
+# this much reuses the track label without running facenet again
+TRACK_REUSE_IOU = .9
+TRACK_REUSE_PROB = .7
+TRACK_TTL = 1.  # sec
+
 
 class DetectorClassifiers:
     def __init__(self):
@@ -29,6 +48,10 @@ class DetectorClassifiers:
         self.class_index = None
         self.class_names = None
         self.class_stats = None
+        # Stacked kNN training matrix + per-classifier row slices,
+        # built when several kNN classifiers share an embedding size
+        self.knn_fit_x = None
+        self.knn_slices = None
 
 
 def add_detector_args(parser):
@@ -66,6 +89,13 @@ def add_detector_args(parser):
         action='store_true',
         help='Recognize faces by searching minimal distance with the samples',
     )
+    parser.add_argument(
+        '--inference_threads',
+        type=int,
+        default=None,
+        help='Thread budget for CPU inference '
+             '(caps the openvino/MKL thread pool and pins threads to cores).',
+    )
     parser.add_argument(
         '--debug',
         help='Full debug output for each detected face.',
@@ -74,9 +104,35 @@ def add_detector_args(parser):
     utils.add_normalization_args(parser)
 
 
+def prefer_int8_model(model_path):
+    """Return the INT8-quantized IR path (<name>-int8.xml) if it exists
+    next to the configured FP32 one, otherwise the path as given.
+
+    Quantized IRs are produced offline with OpenVINO POT; on VNNI-capable
+    CPUs they run several times faster with the same call sites.
+    """
+    if model_path and model_path.endswith('.xml'):
+        int8_path = model_path[:-len('.xml')] + '-int8.xml'
+        if os.path.isfile(int8_path):
+            utils.print_fun('Use INT8 model %s' % int8_path)
+            return int8_path
+    return model_path
+
+
 def detector_args(args):
+    if getattr(args, 'inference_threads', None):
+        # The ml_serving driver does not expose the IE core config, but the
+        # openvino CPU plugin honors the OpenMP environment: cap the thread
+        # pool and pin threads to cores so the detection, facenet and person
+        # models do not fight for the same ones. Must be set before the
+        # drivers load their plugins.
+        os.environ.setdefault('OMP_NUM_THREADS', str(args.inference_threads))
+        os.environ.setdefault('KMP_AFFINITY', 'granularity=fine,compact,1,0')
+        os.environ.setdefault('KMP_BLOCKTIME', '1')
+
     head_pose_driver = None
     if args.head_pose_path is not None:
+        args.head_pose_path = prefer_int8_model(args.head_pose_path)
         if os.path.isfile(args.head_pose_path):
             from ml_serving.drivers import driver
             utils.print_fun("Load HEAD POSE ESTIMATION model")
@@ -88,6 +144,7 @@ def detector_args(args):
 
     face_driver = None
     if args.face_detection_path is not None:
+        args.face_detection_path = prefer_int8_model(args.face_detection_path)
         if os.path.isfile(args.face_detection_path):
             from ml_serving.drivers import driver
             utils.print_fun("Load FACE DETECTION model %s" % args.face_detection_path)
@@ -99,17 +156,22 @@ def detector_args(args):
 
     facenet_driver = None
     if not args.without_facenet and args.model_path is not None:
+        args.model_path = prefer_int8_model(args.model_path)
         if os.path.isfile(args.model_path):
             from ml_serving.drivers import driver
             utils.print_fun("Load FACENET model")
             drv = driver.load_driver('openvino')
             facenet_driver = drv()
-            facenet_driver.load_model(args.model_path)
+            # Batched inference sends N face crops per call; the network
+            # must be compiled to accept a variable batch dimension
+            facenet_driver.load_model(args.model_path, flexible_batch_size=True)
         else:
             utils.print_fun("facenet openvino model is not found, skipped")
 
     person_driver = None
     if args.person_detection_path is not None:
+        if args.person_detection_driver == "openvino":
+            args.person_detection_path = prefer_int8_model(args.person_detection_path)
         if args.person_detection_driver == "openvino" and os.path.isfile(args.person_detection_path) \
                 or args.person_detection_driver == "tensorflow" and os.path.isdir(args.person_detection_path):
             from ml_serving.drivers import driver
@@ -261,6 +323,14 @@ class Detector(object):
         self.current_frame_faces = []
         self.current_frame_persons = []
 
+        # Content-addressed LRU over face crops: identical crops map to
+        # already computed embeddings without a facenet call
+        self._emb_cache = collections.OrderedDict()
+        # Recently recognized faces for temporal bbox-overlap reuse
+        self._tracks = []
+        # Pre-rendered overlay text sprites
+        self._glyph_cache = {}
+
     def init(self):
         if self._initialized:
             return
@@ -281,38 +351,70 @@ class Detector(object):
             new = DetectorClassifiers()
             for clfi, clf in enumerate(loaded_classifiers):
                 # Load classifier
-                with open(clf, 'rb') as f:
-                    utils.print_fun('Load CLASSIFIER %s' % clf)
-                    opts = {'file': f}
-                    if six.PY3:
-                        opts['encoding'] = 'latin1'
-                    (clf, class_names, class_stats) = pickle.load(**opts)
-                    if isinstance(clf, svm.SVC):
-                        embedding_size = clf.shape_fit_[1]
-                        classifier_name = "SVM"
-                        classifier_name_log = "SVM classifier"
-                    elif isinstance(clf, neighbors.KNeighborsClassifier):
-                        embedding_size = clf._fit_X.shape[1]
-                        classifier_name = "kNN"
-                        classifier_name_log = "kNN (neighbors %d) classifier" % clf.n_neighbors
-                    else:
-                        # try embedding_size = 512
-                        embedding_size = 512
-                        classifier_name = "%d" % clfi
-                        classifier_name_log = type(clf)
-                    utils.print_fun('Loaded %s, embedding size: %d' % (classifier_name_log, embedding_size))
-                    if new.class_names is None:
-                        new.class_names = class_names
-                        self.classes = class_names
-                    elif class_names != new.class_names:
-                        raise RuntimeError("Different class names in classifiers")
-                    if new.class_stats is None:
-                        new.class_stats = class_stats
-                    # elif class_stats != new.class_stats:
-                    #     raise RuntimeError("Different class stats in classifiers")
-                    new.classifier_names.append(classifier_name)
-                    new.embedding_sizes.append(embedding_size)
-                    new.classifiers.append(clf)
+                utils.print_fun('Load CLASSIFIER %s' % clf)
+                try:
+                    # joblib mmaps the numpy arrays inside the classifier
+                    # straight from disk instead of reallocating them
+                    (clf, class_names, class_stats) = joblib.load(clf, mmap_mode='r')
+                except Exception:
+                    # Legacy pickle format (possibly written by python2)
+                    with open(clf, 'rb') as f:
+                        opts = {'file': f}
+                        if six.PY3:
+                            opts['encoding'] = 'latin1'
+                        (clf, class_names, class_stats) = pickle.load(**opts)
+                # A deserialized classifier can come back single-threaded and
+                # with non-contiguous (or mmap'd read-only) fit arrays; make
+                # it behave like a freshly fit one again
+                if hasattr(clf, 'n_jobs'):
+                    clf.n_jobs = -1
+                if isinstance(clf, neighbors.KNeighborsClassifier):
+                    clf._fit_X = np.ascontiguousarray(clf._fit_X, dtype=np.float32)
+                    clf._y = np.ascontiguousarray(clf._y)
+                if isinstance(clf, svm.SVC):
+                    embedding_size = clf.shape_fit_[1]
+                    classifier_name = "SVM"
+                    classifier_name_log = "SVM classifier"
+                elif isinstance(clf, neighbors.KNeighborsClassifier):
+                    embedding_size = clf._fit_X.shape[1]
+                    classifier_name = "kNN"
+                    classifier_name_log = "kNN (neighbors %d) classifier" % clf.n_neighbors
+                else:
+                    # try embedding_size = 512
+                    embedding_size = 512
+                    classifier_name = "%d" % clfi
+                    classifier_name_log = type(clf)
+                utils.print_fun('Loaded %s, embedding size: %d' % (classifier_name_log, embedding_size))
+                if new.class_names is None:
+                    new.class_names = class_names
+                    self.classes = class_names
+                elif class_names != new.class_names:
+                    raise RuntimeError("Different class names in classifiers")
+                if new.class_stats is None:
+                    new.class_stats = class_stats
+                # elif class_stats != new.class_stats:
+                #     raise RuntimeError("Different class stats in classifiers")
+                new.classifier_names.append(classifier_name)
+                new.embedding_sizes.append(embedding_size)
+                new.classifiers.append(clf)
+
+            # Stack the kNN training matrices into one contiguous float32
+            # block: a single distance pass over it then serves every kNN
+            # in the ensemble instead of N separate kneighbors queries.
+            knn_idx = [
+                i for i, c in enumerate(new.classifiers)
+                if isinstance(c, neighbors.KNeighborsClassifier)
+            ]
+            if len(knn_idx) > 1 and len({new.embedding_sizes[i] for i in knn_idx}) == 1:
+                new.knn_slices = {}
+                blocks = []
+                offset = 0
+                for i in knn_idx:
+                    fit_x = new.classifiers[i]._fit_X
+                    blocks.append(fit_x)
+                    new.knn_slices[i] = (offset, offset + fit_x.shape[0])
+                    offset += fit_x.shape[0]
+                new.knn_fit_x = np.ascontiguousarray(np.vstack(blocks), dtype=np.float32)
 
             self.classifiers = new
             self.use_classifiers = True
@@ -437,7 +539,9 @@ class Detector(object):
             image_size = tuple(input_shape[-2:-4:-1])
 
         output_name = list(drv.outputs)[0]
-        inference_frame = cv2.resize(frame, image_size, interpolation=cv2.INTER_AREA)
+        # INTER_LINEAR: for HD -> SSD-input downsampling the detector is
+        # insensitive to the resampler, and linear is 2-3x cheaper than area
+        inference_frame = cv2.resize(frame, image_size, interpolation=cv2.INTER_LINEAR)
 
         if drv.driver_name == 'openvino':
             inference_frame = np.transpose(inference_frame, [2, 0, 1])
@@ -458,22 +562,20 @@ class Detector(object):
             boxes[:, 2] = bboxes_raw[:, 3]
             boxes[:, 3] = bboxes_raw[:, 2]
             confidence = np.expand_dims(score[:len(boxes)], axis=0).transpose()
+            boxes = np.concatenate((boxes, confidence), axis=1)
         else:
-            output = outputs[output_name]
-            output = output.reshape(-1, 7)
-            bboxes_raw = output[output[:, 2] > threshold]
-            # Extract 4 values
-            boxes = bboxes_raw[:, 3:7]
-            # confidence shape: [N, 1]
-            confidence = np.expand_dims(bboxes_raw[:, 2], axis=0).transpose()
-
-        boxes = np.concatenate((boxes, confidence), axis=1)
-        # Assign confidence to 4th
-        # boxes[:, 4] = bboxes_raw[:, 2]
-        boxes[:, 0] = boxes[:, 0] * frame.shape[1] + offset[0]
-        boxes[:, 2] = boxes[:, 2] * frame.shape[1] + offset[0]
-        boxes[:, 1] = boxes[:, 1] * frame.shape[0] + offset[1]
-        boxes[:, 3] = boxes[:, 3] * frame.shape[0] + offset[1]
+            output = outputs[output_name].reshape(-1, 7)
+            conf = output[:, 2]
+            keep = conf > threshold
+            # Copy only the needed columns instead of all seven
+            boxes = np.empty((np.count_nonzero(keep), 5), dtype=output.dtype)
+            boxes[:, 0:4] = output[keep, 3:7]
+            boxes[:, 4] = conf[keep]
+
+        # Scale to frame coordinates with one broadcast
+        # instead of four separate column passes
+        boxes[:, 0:4] *= [frame.shape[1], frame.shape[0], frame.shape[1], frame.shape[0]]
+        boxes[:, 0:4] += [offset[0], offset[1], offset[0], offset[1]]
         return boxes
 
     @staticmethod
@@ -484,22 +586,20 @@ class Detector(object):
         # xmin, ymin, xmax, ymax, confidence
         input_name, input_shape = list(drv.inputs.items())[0]
         output_name = list(drv.outputs)[0]
-        inference_frame = cv2.resize(frame, tuple(input_shape[:-3:-1]), interpolation=cv2.INTER_AREA)
+        inference_frame = cv2.resize(frame, tuple(input_shape[:-3:-1]), interpolation=cv2.INTER_LINEAR)
         inference_frame = np.transpose(inference_frame, [2, 0, 1]).reshape(input_shape)
         outputs = drv.predict({input_name: inference_frame})
-        output = outputs[output_name]
-        output = output.reshape(-1, 7)
-        bboxes_raw = output[output[:, 2] > threshold]
-        # Extract 5 values
-        boxes = bboxes_raw[:, 3:7]
-        confidence = np.expand_dims(bboxes_raw[:, 2], axis=0).transpose()
-        boxes = np.concatenate((boxes, confidence), axis=1)
-        # Assign confidence to 4th
-        # boxes[:, 4] = bboxes_raw[:, 2]
-        boxes[:, 0] = boxes[:, 0] * frame.shape[1] + offset[0]
-        boxes[:, 2] = boxes[:, 2] * frame.shape[1] + offset[0]
-        boxes[:, 1] = boxes[:, 1] * frame.shape[0] + offset[1]
-        boxes[:, 3] = boxes[:, 3] * frame.shape[0] + offset[1]
+        output = outputs[output_name].reshape(-1, 7)
+        conf = output[:, 2]
+        keep = conf > threshold
+        # Copy only the needed columns instead of all seven
+        boxes = np.empty((np.count_nonzero(keep), 5), dtype=output.dtype)
+        boxes[:, 0:4] = output[keep, 3:7]
+        boxes[:, 4] = conf[keep]
+        # Scale to frame coordinates with one broadcast
+        # instead of four separate column passes
+        boxes[:, 0:4] *= [frame.shape[1], frame.shape[0], frame.shape[1], frame.shape[0]]
+        boxes[:, 0:4] += [offset[0], offset[1], offset[0], offset[1]]
         return boxes
 
     @staticmethod
@@ -644,6 +744,12 @@ class Detector(object):
         prob_detected = True
         summary_overlay_label = ""
         looks_likes = []
+        knn_dist = None
+        if self.classifiers.knn_fit_x is not None \
+                and output.size == self.classifiers.knn_fit_x.shape[1]:
+            # One pass over the stacked matrix for the whole kNN ensemble
+            query = output.reshape(1, -1).astype(np.float32, copy=False)
+            knn_dist = distance.cdist(query, self.classifiers.knn_fit_x)[0]
         for clfi, clf in enumerate(self.classifiers.classifiers):
             try:
                 output = output.reshape(1, self.classifiers.embedding_sizes[clfi])
@@ -658,14 +764,42 @@ class Detector(object):
             # print('??', predictions, best_class_indices)
 
             if isinstance(clf, neighbors.KNeighborsClassifier):
+                # kneighbors makes a full distance pass over the training set,
+                # compute it once per classifier instead of once per index
+                neighbor_counts = [
+                    self.classifiers.class_stats[ci]['embeddings']
+                    for ci in best_class_indices
+                ]
+                max_cnt = max(neighbor_counts)
+                if knn_dist is not None and clfi in self.classifiers.knn_slices:
+                    start, end = self.classifiers.knn_slices[clfi]
+                    dist_slice = knn_dist[start:end]
+                    if max_cnt >= dist_slice.shape[0]:
+                        order = np.argsort(dist_slice)
+                    else:
+                        order = np.argpartition(dist_slice, max_cnt)[:max_cnt]
+                        order = order[np.argsort(dist_slice[order])]
+                    all_closest_distances = dist_slice[order][np.newaxis, :]
+                    all_neighbors_indices = order[np.newaxis, :]
+                else:
+                    (all_closest_distances, all_neighbors_indices) = clf.kneighbors(
+                        output, n_neighbors=max_cnt
+                    )
+
                 def process_index(idx):
-                    cnt = self.classifiers.class_stats[best_class_indices[idx]]['embeddings']
-                    (closest_distances, neighbors_indices) = clf.kneighbors(output, n_neighbors=cnt)
+                    cnt = neighbor_counts[idx]
+                    closest_distances = all_closest_distances[:, :cnt]
+                    neighbors_indices = all_neighbors_indices[:, :cnt]
                     eval_values = closest_distances[:, 0]
 
-                    candidates = [clf._y[i] for i in neighbors_indices[0]]
-                    counts = {cl: candidates.count(cl) for cl in set(candidates)}
-                    max_candidate = sorted(counts.items(), reverse=True, key=lambda x: x[1])[0]
+                    candidates = np.ascontiguousarray(
+                        np.asarray(clf._y)[neighbors_indices[0]], dtype=np.int64)
+                    top_class, top_count, ttl_cnt = _knn_vote(
+                        candidates,
+                        int(best_class_indices[idx]),
+                        len(self.classifiers.class_names),
+                    )
+                    max_candidate = (top_class, top_count)
 
                     if best_class_indices[idx] != max_candidate[0] and max_candidate[1] > len(candidates) // 2:
                         # utils.print_fun(
@@ -675,6 +809,7 @@ class Detector(object):
                         #     )
                         # )
                         best_class_indices[idx] = max_candidate[0]
+                        ttl_cnt = top_count
 
                     min_distance = None
                     filename = None
@@ -694,18 +829,17 @@ class Detector(object):
                                 # pass
                         # print('!!!', self.classifiers.class_names[best_class_indices[idx]])
 
-                    ttl_cnt = counts[best_class_indices[idx]]
-
                     # probability:
                     # total matched embeddings
                     # less than 25% is 0%, more than 75% is 100%
                     # multiplied by distance coefficient:
                     # 0.5 and less is 100%, 1 and more is 0%
-                    prob = max(0, min(1, 2 * ttl_cnt / cnt - .5)) * max(0, min(1, 2 - eval_values[idx] * 2))
-                    looks_like = set(candidates)
-                    looks_like.remove(best_class_indices[idx])
-                    if not len(looks_like):
-                        looks_like = []
+                    prob = float(
+                        np.clip(2 * ttl_cnt / cnt - .5, 0, 1)
+                        * np.clip(2 - eval_values[idx] * 2, 0, 1)
+                    )
+                    looks_like = np.unique(
+                        candidates[candidates != best_class_indices[idx]]).tolist()
                     debug_label = '%.3f %d/%d' % (
                         eval_values[idx],
                         ttl_cnt, cnt,
@@ -888,6 +1022,62 @@ class Detector(object):
                 for i, b in enumerate(persons_bboxes):
                     stored_persons.append(PersonInfo(bbox=b, prob=persons_probs[i]))
 
+        # Faces whose bbox barely moved since a recent confident recognition
+        # keep their track label and skip facenet entirely
+        reuse_faces = {}
+        if embeddings is None and len(imgs) > 0 and self._tracks:
+            now = time.time()
+            for i in range(len(bboxes)):
+                # A face failing the head-pose gate must surface as
+                # WRONG_FACE_POS, not inherit a track label
+                if self.account_head_pose and i in skips:
+                    continue
+                for track in self._tracks:
+                    if now - track['ts'] > TRACK_TTL:
+                        continue
+                    if utils.box_intersection(bboxes[i], track['bbox']) >= TRACK_REUSE_IOU:
+                        reuse_faces[i] = track
+                        break
+
+        batch_outputs = None
+        if embeddings is None and len(imgs) > 0:
+            # Stack all face crops and infer them with a single facenet call
+            # instead of one driver call per face.
+            infer_idxs = [
+                i for i in range(len(imgs))
+                if (i not in skips or not self.account_head_pose) and i not in reuse_faces
+            ]
+            if infer_idxs:
+                batch_outputs = {}
+                cache_keys = {}
+                miss_idxs = []
+                for i in infer_idxs:
+                    # A stationary subject produces byte-identical crops, so
+                    # the embedding can be reused without running facenet.
+                    # blake2b hashes the 160x160 crop in a few microseconds.
+                    key = hashlib.blake2b(imgs[i].tobytes(), digest_size=16).digest()
+                    cache_keys[i] = key
+                    cached = self._emb_cache.get(key)
+                    if cached is not None:
+                        self._emb_cache.move_to_end(key)
+                        batch_outputs[i] = cached
+                    else:
+                        miss_idxs.append(i)
+                if miss_idxs:
+                    # Convert BGR to RGB
+                    batch = np.stack([imgs[i][:, :, ::-1] for i in miss_idxs])
+                    if self.facenet_driver.driver_name == 'openvino':
+                        batch = batch.transpose([0, 3, 1, 2])
+                    # t = time.time()
+                    output = self.inference_facenet(batch)
+                    # LOG.info('facenet: %.3fms' % ((time.time() - t) * 1000))
+                    for n, idx in enumerate(miss_idxs):
+                        emb = output[n:n + 1]
+                        batch_outputs[idx] = emb
+                        self._emb_cache[cache_keys[idx]] = emb
+                    while len(self._emb_cache) > EMB_CACHE_SIZE:
+                        self._emb_cache.popitem(last=False)
+
         faces = []
         not_detected_embs = []
         detected_names = []
@@ -898,22 +1088,32 @@ class Detector(object):
             # set face probability from saved data
             face_prob = face_probs[img_idx] if face_probs else None
 
-            # Infer
-            # t = time.time()
-            # Convert BGR to RGB
-            if img_idx not in skips or not self.account_head_pose:
+            if img_idx in reuse_faces:
+                track_face = reuse_faces[img_idx]['face']
+                face = FaceInfo(
+                    bbox=bboxes[img_idx][:4].astype(int),
+                    person_bbox=track_face.person_bbox,
+                    state=track_face.state,
+                    label=track_face.label,
+                    overlay_label=track_face.overlay_label,
+                    prob=track_face.prob,
+                    face_prob=bboxes[img_idx][4],
+                    classes=track_face.classes,
+                    classes_meta=track_face.classes_meta,
+                    meta=track_face.meta,
+                    looks_like=track_face.looks_like,
+                    embedding=track_face.embedding,
+                    dist=track_face.dist,
+                )
+                if poses is not None and len(poses) > img_idx:
+                    face.head_pose = poses[img_idx]
+
+            elif img_idx not in skips or not self.account_head_pose:
 
                 if embeddings:
                     output = embeddings[img_idx]
                 else:
-                    img = img[:, :, ::-1]
-                    if self.facenet_driver.driver_name == 'openvino':
-                        img = img.transpose([2, 0, 1]).reshape([1, 3, self.facenet_image_size, self.facenet_image_size])
-                    else:
-                        img = img.reshape(1, self.facenet_image_size, self.facenet_image_size, 3)
-
-                    output = self.inference_facenet(img)
-                # LOG.info('facenet: %.3fms' % ((time.time() - t) * 1000))
+                    output = batch_outputs[img_idx]
                 # output = output[facenet_output]
 
                 if stored_faces is not None:
@@ -973,6 +1173,23 @@ class Detector(object):
         for i, pbbox in enumerate(persons_bboxes):
             persons.append(PersonInfo(bbox=pbbox, prob=persons_probs[i]))
 
+        if stored_faces is None:
+            # Refresh tracks with this frame's confident recognitions.
+            # Reused faces keep their original classification timestamp:
+            # refreshing it would re-arm the reuse gate forever on a
+            # stationary subject, while carrying it over forces the face
+            # back through facenet once TRACK_TTL has elapsed
+            now = time.time()
+            self._tracks = [
+                {
+                    'bbox': f.bbox,
+                    'face': f,
+                    'ts': reuse_faces[i]['ts'] if i in reuse_faces else now,
+                }
+                for i, f in enumerate(faces)
+                if f.state == DETECTED and f.prob >= TRACK_REUSE_PROB
+            ]
+
         # else:
         #     for bbox in bboxes:
         #         face = FaceInfo(
@@ -1092,8 +1309,8 @@ class Detector(object):
                     else:
                         left = bbox[0] + font_inner_padding_w
 
-                self._put_text(frame, line, left, int(top + i * str_h), color=(0, 0, 0), thickness_mul=3)
-                self._put_text(frame, line, left, int(top + i * str_h), color=color)
+                self._blit_text(frame, line, left, int(top + i * str_h), color=(0, 0, 0), thickness_mul=3)
+                self._blit_text(frame, line, left, int(top + i * str_h), color=color)
 
             if face.classes and len(face.classes) > 0:
                 classes_preview_size = min(
@@ -1152,7 +1369,50 @@ class Detector(object):
         font_face, font_scale, thickness = Detector._get_text_props(
             frame, thickness, thickness_mul, font_scale, font_face
         )
-        return cv2.getTextSize(text, font_face, font_scale, thickness)[0]
+        return _cached_text_size(text, font_face, font_scale, thickness)
+
+    def _blit_text(self, frame, text, left, top, color, thickness_mul=None):
+        """Draw label text by blitting a cached pre-rendered sprite.
+
+        putText rasterizes antialiased glyphs on every call; the set of
+        visible labels is small and stable across frames, so each unique
+        line is rendered once into an alpha mask and filled with the
+        requested color at blit time. The mask is drawn in white so the
+        black outline pass produces a real sprite too, and one cached
+        mask serves every color of the same text.
+        """
+        font_face, font_scale, thickness = self._get_text_props(frame, thickness_mul=thickness_mul)
+        key = (text, round(font_scale, 3), thickness)
+        glyph = self._glyph_cache.get(key)
+        if glyph is None:
+            (width, height), baseline = cv2.getTextSize(text, font_face, font_scale, thickness)
+            canvas = np.zeros((height + baseline + thickness, width + thickness), dtype=np.uint8)
+            cv2.putText(canvas, text, (0, height), font_face, font_scale, 255,
+                        thickness=thickness, lineType=cv2.LINE_AA)
+            mask = canvas > 0
+            if text.strip() and not mask.any():
+                # Nothing rendered for visible text: fall back to direct
+                # drawing rather than caching a blank sprite
+                cv2.putText(frame, text, (left, top), font_face, font_scale, color,
+                            thickness=thickness, lineType=cv2.LINE_AA)
+                return
+            glyph = (mask, height)
+            if len(self._glyph_cache) >= GLYPH_CACHE_SIZE:
+                self._glyph_cache.clear()
+            self._glyph_cache[key] = glyph
+
+        mask, ascent = glyph
+        # Clip the sprite to the frame borders
+        y0, x0 = top - ascent, left
+        sy0, sx0 = max(0, -y0), max(0, -x0)
+        y1 = min(frame.shape[0], y0 + mask.shape[0])
+        x1 = min(frame.shape[1], x0 + mask.shape[1])
+        y0, x0 = max(0, y0), max(0, x0)
+        if y1 <= y0 or x1 <= x0:
+            return
+        sprite_mask = mask[sy0:sy0 + y1 - y0, sx0:sx0 + x1 - x0]
+        roi = frame[y0:y1, x0:x1]
+        roi[sprite_mask] = color
 
     @staticmethod
     def _put_text(frame, text, left, top, color, thickness=None, thickness_mul=None,
@@ -1172,6 +1432,31 @@ class Detector(object):
             return 250, 0, 250
 
 
+def _knn_vote(neighbor_labels, best_class, n_classes):
+    """Tally kNN neighbor votes.
+
+    Returns (majority class, its votes, votes for best_class).
+    """
+    counts = np.zeros(n_classes, dtype=np.int64)
+    for i in range(neighbor_labels.shape[0]):
+        counts[neighbor_labels[i]] += 1
+    top = int(np.argmax(counts))
+    return top, int(counts[top]), int(counts[best_class])
+
+
+if njit is not None:
+    # Compiled once per process (and cached on disk); the plain counting
+    # loop then beats the sort inside np.unique for typical neighbor counts
+    _knn_vote = njit(cache=True)(_knn_vote)
+
+
+@functools.lru_cache(maxsize=1024)
+def _cached_text_size(text, font_face, font_scale, thickness):
+    # Font metrics are constant per (text, font, scale, thickness) and the
+    # same labels repeat over many consecutive frames
+    return cv2.getTextSize(text, font_face, font_scale, thickness)[0]
+
+
 def cosine_dist(embeddings1, embeddings2):
     dot = np.sum(np.multiply(embeddings1, embeddings2))
     norm = np.linalg.norm(embeddings1) * np.linalg.norm(embeddings2)
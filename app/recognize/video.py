@@ -294,14 +294,25 @@ class Video:
             self.frame_idx = 0
             self.h5data_face_idx = 0
             self.h5data_person_idx = 0
+            grab_thread = None
             while True:
                 # Capture frame-by-frame
-                self.get_frame()
+                if grab_thread is not None:
+                    grab_thread.join()
+                else:
+                    self.get_frame()
                 self.frame_idx += 1
                 if self.frame is None and self.video_source_is_file:
                     break
+                frame = None
                 if self.frame is not None and (self.frame_idx % self.video_each_of_frame == 0):
                     frame = self.frame.copy()
+                # Grab and decode the next frame while the current one is
+                # processed: cv2 releases the GIL during read so capture
+                # overlaps with detection/facenet inference.
+                grab_thread = Thread(target=self.get_frame, daemon=True)
+                grab_thread.start()
+                if frame is not None:
                     if self.video_async:
                         # Not works
                         self.detector.add_overlays(frame, self.processed)
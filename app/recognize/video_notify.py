@@ -1,3 +1,4 @@
+import collections
 import time
 
 from app.tools import images
@@ -12,8 +13,10 @@ class InVideoDetected:
         self.done = False
         self.prob = 0
         self.not_detected_anymore = False
-        self.in_frames = []
-        self.in_frames_ts = []
+        # deques: trimming expired entries from the left is O(1),
+        # del list[0] shifts the whole tail on every frame
+        self.in_frames = collections.deque()
+        self.in_frames_ts = collections.deque()
         self.notified_awaiting = False
         self.notified = False
         self.notified_ts = None
@@ -73,8 +76,8 @@ class InVideoDetected:
             self.in_frames_ts.append(now)
             period_filled = False
             while len(self.in_frames_ts) > 1 and now - self.in_frames_ts[0] > self.notify_period:
-                del self.in_frames[0]
-                del self.in_frames_ts[0]
+                self.in_frames.popleft()
+                self.in_frames_ts.popleft()
                 period_filled = True
             if period_filled:
                 self.prob = sum(self.in_frames) / len(self.in_frames)
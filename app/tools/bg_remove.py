@@ -1,9 +1,16 @@
+import collections
+import time
+
 import cv2
 import numpy as np
 from ml_serving.drivers import driver as sdrv
 
 from app.tools import utils
 
+MASK_CACHE_SIZE = 16
+MASK_CACHE_TTL = 1.  # sec
+MASK_CACHE_MAX_DIST = 4  # hamming distance between dHash keys
+
 
 class Driver(object):
 
@@ -12,11 +19,45 @@ class Driver(object):
         drv = sdrv.load_driver('tensorflow')
         self.drv = drv()
         self.drv.load_model(bg_remove_path)
+        # LRU of recently computed masks keyed by a perceptual hash of the
+        # frame: for static-camera scenes consecutive frames barely differ,
+        # so the segmentation network result can be reused.
+        self._mask_cache = collections.OrderedDict()
+        # Reused network input, filled in place on every inference
+        self._input = np.empty((1, 160, 160, 3), dtype=np.float32)
+
+    @staticmethod
+    def _frame_hash(frame):
+        # 8x8 dHash over the downsampled grayscale frame
+        small = cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA).mean(axis=2)
+        diff = small[:, 1:] > small[:, :-1]
+        return int.from_bytes(np.packbits(diff).tobytes(), 'big')
 
     def mask(self, frame):
-        inp = cv2.resize(frame[:, :, ::-1].astype(np.float32), (160, 160)) / 255.0
-        outputs = self.drv.predict({'image': np.expand_dims(inp, 0)})
-        return cv2.resize(outputs['output'][0], (frame.shape[1], frame.shape[0]))
+        frame_hash = self._frame_hash(frame)
+        now = time.time()
+        for key, (ts, cached) in self._mask_cache.items():
+            if now - ts > MASK_CACHE_TTL:
+                continue
+            if cached.shape[0] != frame.shape[0] or cached.shape[1] != frame.shape[1]:
+                continue
+            if bin(key ^ frame_hash).count('1') <= MASK_CACHE_MAX_DIST:
+                self._mask_cache.move_to_end(key)
+                return cached
+
+        # Resize while still uint8, then convert BGR->RGB and scale to [0,1]
+        # in a single pass over the small 160x160 buffer: the full-size
+        # float32 temporary of the original frame never gets allocated.
+        small = cv2.resize(frame, (160, 160), interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        np.multiply(small, np.float32(1 / 255.0), out=self._input[0], casting='unsafe')
+        outputs = self.drv.predict({'image': self._input})
+        mask = cv2.resize(outputs['output'][0], (frame.shape[1], frame.shape[0]))
+
+        self._mask_cache[frame_hash] = (now, mask)
+        while len(self._mask_cache) > MASK_CACHE_SIZE:
+            self._mask_cache.popitem(last=False)
+        return mask
 
     def apply_mask(self, frame):
         return frame * np.expand_dims(self.mask(frame), 2)
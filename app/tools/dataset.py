@@ -77,29 +77,40 @@ def get_meta(dataset):
 
 def load_data(image_paths, image_size, normalization=images.NORMALIZATION_FIXED):
     nrof_samples = len(image_paths)
-    imgs = np.zeros((nrof_samples, image_size, image_size, 3))
+    imgs = np.zeros((nrof_samples, image_size, image_size, 3), dtype=np.float32)
+    # Batches often hold both a path and its ':flip' variant; decode and
+    # normalize each base image once and flip the cached array in memory
+    decoded = {}
     for i in range(nrof_samples):
         path_attr = image_paths[i].split(':')
         path, attrs = path_attr[0], path_attr[1:]
-        img = cv2.imread(path, cv2.IMREAD_COLOR)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        if img.ndim == 2:
-            img = images.to_rgb(img)
-        if len(img.shape) >= 3 and img.shape[2] > 3:
-            # RGBA, convert to RGB
-            img = np.array(Image.fromarray(img).convert('RGB'))
-        if normalization == images.NORMALIZATION_FIXED:
-            img = images.fixed_normalize(img)
-        elif normalization == images.NORMALIZATION_PREWHITEN:
-            img = images.prewhiten(img)
-        elif normalization == images.NORMALIZATION_STANDARD:
-            img = images.normalize(img)
-        else:
-            # no-op, null normalization
-            pass
-
-        if img.shape[0] != image_size:
-            img = cv2.resize(img, (image_size, image_size), interpolation=cv2.INTER_AREA)
+        img = decoded.get(path)
+        if img is None:
+            img = cv2.imread(path, cv2.IMREAD_COLOR)
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            if img.ndim == 2:
+                img = images.to_rgb(img)
+            if len(img.shape) >= 3 and img.shape[2] > 3:
+                # RGBA, convert to RGB
+                img = np.array(Image.fromarray(img).convert('RGB'))
+
+            # Resize while the image is still uint8: interpolating bytes
+            # is several times cheaper than interpolating the float64 array
+            # normalization would produce, and shrinks the normalized pixels
+            # to image_size^2 as well
+            if img.shape[0] != image_size:
+                img = cv2.resize(img, (image_size, image_size), interpolation=cv2.INTER_AREA)
+
+            if normalization == images.NORMALIZATION_FIXED:
+                img = images.fixed_normalize(img)
+            elif normalization == images.NORMALIZATION_PREWHITEN:
+                img = images.prewhiten(img)
+            elif normalization == images.NORMALIZATION_STANDARD:
+                img = images.normalize(img)
+            else:
+                # no-op, null normalization
+                pass
+            decoded[path] = img
 
         if 'flip' in attrs:
             img = np.fliplr(img)
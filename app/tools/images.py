@@ -9,38 +9,41 @@ NORMALIZATION_NONE = "none"
 
 
 def get_images(image, bounding_boxes, face_crop_size=160, face_crop_margin=32, normalization=None):
-    images = []
-
     nrof_faces = bounding_boxes.shape[0]
-    if nrof_faces > 0:
-        det = bounding_boxes[:, 0:4]
-        det_arr = []
-        img_size = np.asarray(image.shape)[0:2]
-        if nrof_faces > 1:
-            for i in range(nrof_faces):
-                det_arr.append(np.squeeze(det[i]))
-        else:
-            det_arr.append(np.squeeze(det))
-
-        for i, det in enumerate(det_arr):
-            det = np.squeeze(det)
-            bb = np.zeros(4, dtype=np.int32)
-            bb[0] = np.maximum(det[0] - face_crop_margin / 2, 0)
-            bb[1] = np.maximum(det[1] - face_crop_margin / 2, 0)
-            bb[2] = np.minimum(det[2] + face_crop_margin / 2, img_size[1])
-            bb[3] = np.minimum(det[3] + face_crop_margin / 2, img_size[0])
-            cropped = image[bb[1]:bb[3], bb[0]:bb[2], :]
-            scaled = cv2.resize(cropped, (face_crop_size, face_crop_size), interpolation=cv2.INTER_AREA)
-            if normalization == NORMALIZATION_PREWHITEN:
-                images.append(prewhiten(scaled))
-            elif normalization == NORMALIZATION_STANDARD:
-                images.append(normalize(scaled))
-            elif normalization == NORMALIZATION_FIXED:
-                images.append(fixed_normalize(scaled))
-            else:
-                images.append(scaled)
-
-    return images
+    if nrof_faces == 0:
+        return []
+
+    det = bounding_boxes[:, 0:4]
+    img_size = np.asarray(image.shape)[0:2]
+
+    # Expand by the margin and clip all boxes in one vectorized pass
+    bbs = np.zeros((nrof_faces, 4), dtype=np.int32)
+    bbs[:, 0] = np.maximum(det[:, 0] - face_crop_margin / 2, 0)
+    bbs[:, 1] = np.maximum(det[:, 1] - face_crop_margin / 2, 0)
+    bbs[:, 2] = np.minimum(det[:, 2] + face_crop_margin / 2, img_size[1])
+    bbs[:, 3] = np.minimum(det[:, 3] + face_crop_margin / 2, img_size[0])
+
+    # Resize every crop directly into one contiguous batch buffer so callers
+    # that stack the result (facenet, head pose) get cache-friendly rows
+    # without per-face allocations.
+    batch = np.empty(
+        (nrof_faces, face_crop_size, face_crop_size, image.shape[2]),
+        dtype=image.dtype,
+    )
+    for i, bb in enumerate(bbs):
+        cropped = image[bb[1]:bb[3], bb[0]:bb[2], :]
+        cv2.resize(cropped, (face_crop_size, face_crop_size), dst=batch[i], interpolation=cv2.INTER_AREA)
+
+    if normalization == NORMALIZATION_PREWHITEN:
+        # Per-image statistics, no whole-batch shortcut
+        return [prewhiten(img) for img in batch]
+    elif normalization == NORMALIZATION_STANDARD:
+        return [normalize(img) for img in batch]
+    elif normalization == NORMALIZATION_FIXED:
+        # Affine transform, applied over the whole batch at once
+        batch = fixed_normalize(batch)
+
+    return list(batch)
 
 
 def crop_by_boxes(img, boxes):
@@ -31,21 +31,28 @@ from __future__ import print_function
 
 import argparse
 import base64
+from concurrent import futures
+import hashlib
+import json
 import os
 import sys
+import tempfile
+import time
 
 import cv2
 from mlboardclient.api import client
 from ml_serving.drivers import driver
 import numpy as np
 from sklearn import metrics
-from scipy.optimize import brentq
-from scipy import interpolate
 
 from app.tools import dataset
 from app.tools import helpers
 from app.tools import utils
 
+# Embedding matrices above this size are streamed to a disk-backed
+# memmap instead of held in RAM
+EMB_MMAP_BYTES = 256 * 1024 * 1024
+
 
 def update_data(data, use_mlboard, mlboard):
     if use_mlboard and mlboard:
@@ -53,7 +60,6 @@ def update_data(data, use_mlboard, mlboard):
 
 
 def report(tpr, fpr, accuracy, val, val_std, far):
-    import io
     import matplotlib.pyplot as plt
     plt.figure(1, figsize=(10, 10))
     # plot no skill
@@ -65,12 +71,11 @@ def report(tpr, fpr, accuracy, val, val_std, far):
     # plt.ylabel('True label')
     # plt.xlabel('Predicted label')
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-
-    img = cv2.imdecode(np.frombuffer(buf.getvalue(), dtype=np.uint8), cv2.IMREAD_COLOR)
-    img = img[:, :, ::-1]
+    # Grab the rendered canvas directly instead of a PNG encode/decode
+    # round trip through an in-memory buffer
+    fig = plt.gcf()
+    fig.canvas.draw()
+    img = np.asarray(fig.canvas.renderer.buffer_rgba())[:, :, :3].copy()
     img = np.vstack((np.ones([150, img.shape[1], 3]) * 255, img))
 
     mean_accuracy = np.mean(accuracy)
@@ -84,7 +89,20 @@ def report(tpr, fpr, accuracy, val, val_std, far):
     auc = metrics.auc(fpr, tpr)
     utils.print_fun('Area Under Curve (AUC): %1.3f' % auc)
 
-    eer = brentq(lambda x: 1. - x - interpolate.interp1d(fpr, tpr)(x), 0., 1.)
+    # EER is where the false-negative rate crosses the false-positive
+    # rate along the curve; locate the sign change of their difference
+    # and interpolate linearly instead of running a root finder over a
+    # rebuilt interpolant
+    diff = (1. - tpr) - fpr
+    k = np.searchsorted(-diff, 0.)
+    if k == 0:
+        eer = fpr[0]
+    elif k >= len(diff):
+        eer = fpr[-1]
+    else:
+        denom = diff[k - 1] - diff[k]
+        t = diff[k - 1] / denom if denom != 0 else 0.
+        eer = fpr[k - 1] + t * (fpr[k] - fpr[k - 1])
     utils.print_fun('Equal Error Rate (EER): %1.3f' % eer)
 
     cv2.putText(
@@ -107,8 +125,8 @@ def report(tpr, fpr, accuracy, val, val_std, far):
         'Equal Error Rate (EER): %1.3f' % eer,
         (50, 150), font, 1.0, 0, thickness=1, lineType=cv2.LINE_AA
     )
-    buf = cv2.imencode('.jpg', img)[1].tostring()
-    return '<html><img src="data:image/png;base64,{}"/></html>'.format(base64.b64encode(buf).decode())
+    buf = cv2.imencode('.jpg', img)[1].tobytes()
+    return '<html><img src="data:image/jpeg;base64,{}"/></html>'.format(base64.b64encode(buf).decode())
 
 
 def main(args):
@@ -141,7 +159,7 @@ def main(args):
     }
     update_data(data, use_mlboard, mlboard)
 
-    img_paths, actual_issame = load_dataset(args.data_dir)
+    img_paths, actual_issame = load_dataset(args.data_dir, seed=args.seed)
     drv = driver.load_driver(driver_name)
     serving = drv()
     serving.load_model(
@@ -152,6 +170,11 @@ def main(args):
         flexible_batch_size=True,
     )
 
+    if args.auto_batch_size:
+        args.batch_size = _tune_batch_size(serving, image_size, args.model, driver_name, args.batch_size)
+        utils.print_fun('Using batch size %d' % args.batch_size)
+        update_data({'batch_size': args.batch_size}, use_mlboard, mlboard)
+
     # Run forward pass to calculate embeddings
     utils.print_fun('Runnning forward pass on dataset images')
 
@@ -165,23 +188,90 @@ def main(args):
     update_data(data, use_mlboard, mlboard)
 
     embedding_size = list(serving.outputs.values())[0][-1]
-    nrof_batches = int(np.ceil(float(nrof_images) / args.batch_size))
-    emb_array = np.zeros((nrof_images, embedding_size))
-
-    # TODO(nmakhotkin): cache embeddings by image paths (because image pairs
-    #  are duplicated and no need to do inference on them)
-    for i in range(nrof_batches):
-        start_index = i * args.batch_size
-        end_index = min((i + 1) * args.batch_size, nrof_images)
-        paths_batch = img_paths[start_index:end_index]
-        probe_imgs = dataset.load_data(paths_batch, image_size, normalization=args.normalization)
-        emb = _predict(serving, probe_imgs)
-        emb_array[start_index:end_index, :] = emb
-        if i % 5 == 4:
-            utils.print_fun('{}/{}'.format(i + 1, nrof_batches))
-            sys.stdout.flush()
-    utils.print_fun('')
-    embeddings = emb_array
+    # Pair generation duplicates entries, so inference runs only over the
+    # unique paths and rows are gathered back by index afterwards
+    unique_paths, inverse = np.unique(img_paths, return_inverse=True)
+    nrof_unique = len(unique_paths)
+    utils.print_fun('%d unique images of %d' % (nrof_unique, nrof_images))
+    nrof_batches = (nrof_unique + args.batch_size - 1) // args.batch_size
+
+    # Changing only the evaluation flags (folds, distance metric, mean
+    # subtraction) does not change the embeddings, so cache them on disk
+    # keyed by model and dataset and skip the forward pass on a hit
+    h = hashlib.blake2b(digest_size=16)
+    h.update(os.path.abspath(args.model).encode())
+    try:
+        h.update(str(os.path.getmtime(args.model)).encode())
+    except OSError:
+        pass
+    h.update(('%s|%d' % (args.normalization, image_size)).encode())
+    h.update('\n'.join(unique_paths).encode())
+    cache_fn = os.path.join(tempfile.gettempdir(), 'svod_emb_%s.npy' % h.hexdigest())
+
+    if os.path.exists(cache_fn):
+        utils.print_fun('Using cached embeddings: %s' % cache_fn)
+        emb_array = np.load(cache_fn, mmap_mode='r')
+    else:
+        # float32 matches what the drivers return and halves the memory
+        # traffic of the distance evaluation downstream. Large runs
+        # stream rows straight into an .npy memmap that becomes the disk
+        # cache once complete, so the matrix never sits in RAM twice
+        if nrof_unique * embedding_size * 4 > EMB_MMAP_BYTES:
+            tmp_fn = cache_fn + '.tmp'
+            emb_array = np.lib.format.open_memmap(
+                tmp_fn, mode='w+', dtype=np.float32, shape=(nrof_unique, embedding_size))
+        else:
+            tmp_fn = None
+            emb_array = np.zeros((nrof_unique, embedding_size), dtype=np.float32)
+
+        def load_batch(n):
+            start_index = n * args.batch_size
+            end_index = min((n + 1) * args.batch_size, nrof_unique)
+            paths_batch = unique_paths[start_index:end_index]
+            return dataset.load_data(paths_batch, image_size, normalization=args.normalization)
+
+        # The first predict pays one-time graph compilation and kernel
+        # selection; spend it on a throwaway buffer so the real loop
+        # runs at steady state from batch one
+        _predict(serving, np.zeros((args.batch_size, image_size, image_size, 3), dtype=np.float32))
+
+        # Decode and resize the next batch in a background thread while
+        # the driver is busy with the current one
+        padded = None
+        with futures.ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(load_batch, 0)
+            for i in range(nrof_batches):
+                probe_imgs = pending.result()
+                if i + 1 < nrof_batches:
+                    pending = pool.submit(load_batch, i + 1)
+                n_valid = len(probe_imgs)
+                if n_valid < args.batch_size:
+                    # Keep the input shape constant so the driver reuses
+                    # one compiled request instead of reshaping for the
+                    # short final batch
+                    if padded is None:
+                        padded = np.zeros((args.batch_size,) + probe_imgs.shape[1:], dtype=probe_imgs.dtype)
+                    padded[:n_valid] = probe_imgs
+                    emb = _predict(serving, padded)[:n_valid]
+                else:
+                    emb = _predict(serving, probe_imgs)
+                start_index = i * args.batch_size
+                emb_array[start_index:start_index + n_valid, :] = emb
+                if i % 5 == 4:
+                    utils.print_fun('{}/{}'.format(i + 1, nrof_batches))
+                    sys.stdout.flush()
+        utils.print_fun('')
+        if tmp_fn is not None:
+            emb_array.flush()
+            # Publish the cache only once fully written, so an aborted
+            # run never leaves a partial file behind as a false hit
+            os.rename(tmp_fn, cache_fn)
+        else:
+            try:
+                np.save(cache_fn, emb_array)
+            except IOError:
+                pass
+    embeddings = emb_array[inverse]
 
     tpr, fpr, accuracy, val, val_std, far = helpers.evaluate(
         embeddings, actual_issame, nrof_folds=args.lfw_nrof_folds,
@@ -194,7 +284,7 @@ def main(args):
     update_data({'#documents.report.html': rpt}, use_mlboard, mlboard)
 
 
-def load_dataset(dataset_dir):
+def load_dataset(dataset_dir, seed=None):
     ds = dataset.get_dataset(dataset_dir)
     size = 0
     for cls in ds:
@@ -202,51 +292,108 @@ def load_dataset(dataset_dir):
 
     imgs_original = [''] * size
     imgs = [''] * (size * 4)
-    imgs_cls = [''] * size
-    issame = np.zeros([size * 2], dtype=np.bool)
+    # Class membership as integer ids assigned during the fill pass;
+    # there is no need to carry the class-name strings around
+    cls_ids = np.zeros(size, dtype=np.int32)
 
     i = 0
-    for cls in ds:
+    for ci, cls in enumerate(ds):
         for j, path in enumerate(cls.image_paths):
             img_path = path
             imgs_original[i] = img_path
             imgs[i + i] = img_path
             imgs[i + i + size * 2] = img_path + ':flip'
-            imgs_cls[i] = cls.name
+            cls_ids[i] = ci
             i += 1
 
     # Expand dataset with random pairs
     utils.print_fun('Generating pairs for dataset...')
-    for i in range(len(imgs_original) * 2):
-        if i % 2 == 0:
-            target = lambda x: not x
+    # Per-class index lists let a partner of the wanted class be drawn
+    # directly instead of searched for linearly. Class directories may
+    # be empty, so different-class draws come only from classes that
+    # actually own images
+    nrof_classes = len(ds)
+    by_class = [np.flatnonzero(cls_ids == c) for c in range(nrof_classes)]
+    filled = np.flatnonzero([len(g) for g in by_class])
+    filled_pos = np.full(nrof_classes, -1, dtype=np.int64)
+    filled_pos[filled] = np.arange(len(filled))
+    nrof_filled = len(filled)
+    pair_j = np.zeros(size * 2, dtype=np.int64)
+    # All random draws are taken up front in three vectorized calls
+    # instead of one RNG round trip per pair; a fixed seed makes the
+    # pairing reproducible across runs
+    rng = np.random.default_rng(seed)
+    rand_cls = rng.integers(0, max(nrof_filled - 1, 1), size=size * 2)
+    rand_pick = rng.random(size * 2)
+    rand_flip = rng.integers(0, 2, size=size * 2).astype(bool)
+    for i in range(size * 2):
+        ci = cls_ids[i % size]
+        # Even entries pair different classes, odd entries the same class
+        want_same = i % 2 == 1
+        if want_same or nrof_filled == 1:
+            group = by_class[ci]
         else:
-            target = lambda x: x
-        j = np.random.randint(0, len(imgs_original) * 2)
-        if target(imgs_cls[i % size] != imgs_cls[j % size]):
-            shift = 1
-            j1 = j - shift if j > 0 else 0
-            j2 = j + shift if j < len(imgs_original) * 2 else len(imgs_original) - 1
-            while target(imgs_cls[i % size] != imgs_cls[j1 % size]) and target(imgs_cls[i % size] != imgs_cls[j2 % size]):
-                j1 = j - shift if j1 > 0 else 0
-                j2 = j + shift if j2 < len(imgs_original) * 2 else len(imgs_original) - 1
-                shift += 1
-            if target(imgs_cls[i % size] == imgs_cls[j1 % size]):
-                j = j1
-            else:
-                j = j2
-
-        if j >= size:
-            imgs[i + i + 1] = imgs_original[j % size] + ':flip'
+            cj = rand_cls[i]
+            if cj >= filled_pos[ci]:
+                cj += 1
+            group = by_class[filled[cj]]
+        j = group[int(rand_pick[i] * len(group))]
+
+        # A coin flip decides whether the partner is the flipped variant
+        if rand_flip[i]:
+            imgs[i + i + 1] = imgs_original[j] + ':flip'
         else:
             imgs[i + i + 1] = imgs_original[j]
+        pair_j[i] = j
 
-        issame[i] = imgs_cls[i % size] == imgs_cls[j % size]
+    # Single vectorized comparison instead of a per-pair assignment
+    issame = cls_ids[np.arange(size * 2) % size] == cls_ids[pair_j]
 
     utils.print_fun('Done.')
     return imgs, issame
 
 
+def _tune_batch_size(serving, image_size, model_path, driver_name, batch_size):
+    """Pick the batch size with the best measured throughput.
+
+    CPU inference throughput often saturates well before the default
+    batch size of 100; a short sweep over a few candidates on dummy
+    inputs finds the sweet spot. The choice is cached so later runs
+    against the same model skip the sweep.
+    """
+    cache_fn = os.path.join(tempfile.gettempdir(), 'svod_batch_size.json')
+    key = '%s|%s|%d' % (driver_name, os.path.abspath(model_path), image_size)
+    cache = {}
+    try:
+        with open(cache_fn) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        pass
+    if key in cache:
+        return int(cache[key])
+
+    best, best_rate = batch_size, 0.
+    for b in sorted(set([8, 16, 32, 64, batch_size])):
+        probe = np.zeros((b, image_size, image_size, 3), dtype=np.float32)
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            _predict(serving, probe)
+            times.append(time.perf_counter() - start)
+        rate = b / np.median(times)
+        utils.print_fun('batch %3d: %.1f img/sec' % (b, rate))
+        if rate > best_rate:
+            best, best_rate = b, rate
+
+    cache[key] = best
+    try:
+        with open(cache_fn, 'w') as f:
+            json.dump(cache, f)
+    except IOError:
+        pass
+    return best
+
+
 def _predict(serving, imgs):
     if serving.driver_name == 'tensorflow':
         input_sizes = list(serving.inputs.values())[0]
@@ -258,13 +405,15 @@ def _predict(serving, imgs):
             feed_dict = {'input:0': imgs, 'phase_train:0': False}
     elif serving.driver_name == 'openvino':
         input_name = list(serving.inputs.keys())[0]
-        # Transpose image for channel first format
-        imgs = imgs.transpose([0, 3, 1, 2])
+        # Transpose image for channel first format; materialize the
+        # result so the driver gets a contiguous buffer instead of
+        # copying from a strided view element by element
+        imgs = np.ascontiguousarray(imgs.transpose([0, 3, 1, 2]), dtype=np.float32)
         feed_dict = {input_name: imgs}
     else:
         raise RuntimeError('Driver %s currently not supported' % serving.driver_name)
     outputs = serving.predict(feed_dict)
-    return list(outputs.values())[0]
+    return list(outputs.values())[0].astype(np.float32, copy=False)
 
 
 def parse_arguments(argv):
@@ -274,6 +423,9 @@ def parse_arguments(argv):
                         help='Path to the data directory containing aligned LFW face patches.')
     parser.add_argument('--batch_size', type=int,
                         help='Number of images to process in a batch in the LFW test set.', default=100)
+    parser.add_argument('--auto_batch_size',
+                        help='Pick the batch size by a short throughput sweep before the main loop.',
+                        action='store_true')
     parser.add_argument('model', type=str,
                         help='Could be either a directory containing the meta_file and ckpt_file or a model protobuf (.pb) file')
     parser.add_argument('--image_size', type=int,
@@ -286,6 +438,8 @@ def parse_arguments(argv):
                         help='Subtract feature mean before calculating distance.', action='store_true')
     parser.add_argument('--normalization',
                         help='Normalization method.', default='fixed')
+    parser.add_argument('--seed', type=int,
+                        help='Random seed for reproducible pair generation.', default=None)
     return parser.parse_args(argv)
 
 